@@ -1,9 +1,17 @@
 # Backend/api/auth.py
 import json
 import hashlib
+import hmac
+import os
 from pathlib import Path
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
 USERS_FILE = Path(__file__).parent.parent / "data" / "users.json"
+# Token compartido entre el primario y sus réplicas (mismo valor en todos los nodos)
+TOKEN_REPLICACION = os.environ.get("BIGTOOLS_TOKEN_REPLICACION")
 
 def cargar_usuarios():
     try:
@@ -24,3 +32,37 @@ def validar_usuario(username: str, password: str) -> bool:
         if u["username"] == username and u["password"] == password:
             return True
     return False
+
+_basic = HTTPBasic()
+
+def validar_admin(credenciales: HTTPBasicCredentials = Depends(_basic)) -> str:
+    """
+    Dependencia para rutas de administración (HTTP Basic contra users.json).
+    """
+    if not validar_usuario(credenciales.username, credenciales.password):
+        raise HTTPException(
+            status_code=401,
+            detail="Usuario o contraseña incorrectos",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return credenciales.username
+
+_basic_opcional = HTTPBasic(auto_error=False)
+
+def validar_replicacion(
+    x_token_replicacion: Optional[str] = Header(None),
+    credenciales: Optional[HTTPBasicCredentials] = Depends(_basic_opcional)
+) -> None:
+    """
+    Dependencia para las rutas de replicación: exige el token compartido
+    (cabecera X-Token-Replicacion) o credenciales de administrador.
+    """
+    if TOKEN_REPLICACION and x_token_replicacion and hmac.compare_digest(x_token_replicacion, TOKEN_REPLICACION):
+        return
+    if credenciales and validar_usuario(credenciales.username, credenciales.password):
+        return
+    raise HTTPException(
+        status_code=401,
+        detail="Se requiere el token de replicación o credenciales de administrador",
+        headers={"WWW-Authenticate": "Basic"},
+    )
@@ -4,19 +4,94 @@ Clase para gestionar la base de conocimientos de máquinas.
 Compatible con la nueva estructura simplificada de JSON.
 """
 
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
+import copy
+import functools
+import inspect
 import json
+import re
+import threading
+import weakref
 from pathlib import Path
+from Backend.api.catalogo import Catalogo
 from Backend.api.nodo import Nodo
+from Backend.api.replicacion import RegistroEdiciones
 
-JSON_LATEST = 1
+JSON_LATEST = 2
+# Versiones que se pueden leer. La v1 guarda los textos en cada hoja; al
+# guardar se reescribe en la v2, con el catálogo compartido ("__catalogo").
+JSON_COMPATIBLES = (1, JSON_LATEST)
 DEFAULT_JSON = "Backend/data/base_conocimiento.json"
+# Con indent=2 cada ID quedaría en su propia línea; las listas de IDs se escriben en una
+_LISTA_IDS = re.compile(r'("soluciones_ids": )\[\s*([^\]]*?)\s*\]')
+
+# Métodos de edición que se anotan en el registro y pueden aplicarse en una réplica
+OPERACIONES_REPLICABLES = set()
+
+def replicable(metodo):
+    """
+    Marca un método de edición como replicable: se ejecuta bajo el lock de la
+    base y, si termina sin error, se anota en el registro con sus argumentos
+    (si la base tiene registro: las bases de sitio no se replican).
+    """
+    firma = inspect.signature(metodo)
+    OPERACIONES_REPLICABLES.add(metodo.__name__)
+
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        registrados = None
+        if self.registro is not None:
+            argumentos = firma.bind(self, *args, **kwargs)
+            argumentos.apply_defaults()
+            # Copia antes de ejecutar: algunos métodos modifican los dicts recibidos
+            registrados = copy.deepcopy({k: v for k, v in argumentos.arguments.items() if k != "self"})
+        with self._lock:
+            if self.descargada:
+                raise ValueError("La base del sitio se descargó de memoria durante la edición. Reintente la operación.")
+            # Si la edición falla se deshace lo que alcanzó a registrar en el catálogo
+            # (y la copia de una máquina heredada): las réplicas sólo ven las ediciones
+            # exitosas y sus contadores de IDs deben avanzar igual que los del primario.
+            catalogo, propias = self.catalogo.copia(), set(self.maquinas)
+            try:
+                resultado = metodo(self, *args, **kwargs)
+            except Exception:
+                self.catalogo = catalogo
+                for nombre in set(self.maquinas) - propias:
+                    del self.maquinas[nombre]
+                raise
+            if self.registro is not None:
+                self.registro.agregar(metodo.__name__, registrados)
+            return resultado
+    return envoltura
 
 class BaseConocimiento:
-    def __init__(self, archivo_json: str = DEFAULT_JSON):
+    def __init__(
+        self,
+        archivo_json: str = DEFAULT_JSON,
+        persistir: bool = True,
+        espacio: str = "",
+        con_registro: bool = True,
+        resolver_padre: Optional[Callable[[str], 'BaseConocimiento']] = None
+    ):
         self.archivo_path = Path(archivo_json)
         self.description = "Base de conocimientos de máquinas"
         self.maquinas: Dict[str, Nodo] = {}
+        self.espacio = espacio
+        # Superposición: nombre del sitio del que hereda ("__hereda" en el JSON)
+        # y la base ya cargada de ese sitio, que obtiene 'resolver_padre' (el
+        # RegistroSitios) antes de leer las máquinas: sus hojas usan IDs del padre.
+        self.hereda: Optional[str] = None
+        self.padre: Optional['BaseConocimiento'] = None
+        self.hijas: "weakref.WeakSet[BaseConocimiento]" = weakref.WeakSet()
+        self._resolver_padre = resolver_padre
+        self.catalogo = self._nuevo_catalogo()
+        # Una réplica no escribe el JSON: su estado viene del primario
+        self.persistir = persistir
+        # Sólo la base que se replica necesita el registro de ediciones
+        self.registro = RegistroEdiciones() if con_registro else None
+        self._lock = threading.RLock()
+        # La marca el RegistroSitios al sacar la base de memoria: ya no admite ediciones
+        self.descargada = False
         self.from_json(self.archivo_path)
 
     # ------------ CARGA Y GUARDADO ----------------
@@ -24,6 +99,7 @@ class BaseConocimiento:
         if not filename.exists():
             print(f"Archivo {filename} no encontrado.")
             self.maquinas = {}
+            self.catalogo = self._nuevo_catalogo()
             return self
         with open(filename, 'r', encoding='utf8') as f:
             try:
@@ -31,44 +107,137 @@ class BaseConocimiento:
             except json.JSONDecodeError:
                 print(f"Error al decodificar {filename}.")
                 self.maquinas = {}
+                self.catalogo = self._nuevo_catalogo()
                 return self
-        if "__v" in data and data["__v"] != JSON_LATEST:
+        return self.from_dict(data)
+
+    def from_dict(self, data: dict):
+        if "__v" in data and data["__v"] not in JSON_COMPATIBLES:
             raise ValueError("Actualizar JSON a nueva versión")
         self.description = data.get("description", self.description)
-        self.maquinas = {}
+        self.hereda = data.get("__hereda")
+        if self.hereda and self._resolver_padre:
+            self.padre = self._resolver_padre(self.hereda)
+            self.padre.hijas.add(self)
+        catalogo = self._nuevo_catalogo(data.get("__catalogo"))
+        maquinas = {}
         for nombre_maquina, arbol_dict in data.items():
             if nombre_maquina.startswith("__") or not isinstance(arbol_dict, dict):
                 continue
             arbol_dict['nombre'] = nombre_maquina
-            self.maquinas[nombre_maquina] = Nodo.from_dict(arbol_dict)
+            maquinas[nombre_maquina] = Nodo.from_dict(arbol_dict, catalogo)
+        self.catalogo = catalogo
+        self.maquinas = maquinas
         return self
 
-    def to_json(self, filename: Optional[Path] = None):
-        path = filename or self.archivo_path
+    def _nuevo_catalogo(self, data: Optional[dict] = None) -> Catalogo:
+        return Catalogo.from_dict(data, self.espacio, heredado=self._catalogo_heredado)
+
+    def _catalogo_heredado(self) -> Optional[Catalogo]:
+        # Se resuelve en cada consulta: el padre puede reemplazar su catálogo
+        # (al deshacer una edición o cargar una instantánea).
+        return self.padre.catalogo if self.padre else None
+
+    def to_dict(self) -> dict:
+        self._completar_catalogo()
         obj = {
             "__v": JSON_LATEST,
-            "description": self.description
+            "description": self.description,
+            "__catalogo": self.catalogo.to_dict()
         }
+        if self.hereda:
+            obj["__hereda"] = self.hereda
         for nombre_maquina, nodo_raiz in self.maquinas.items():
-            dict_para_guardar = nodo_raiz.to_dict()
+            dict_para_guardar = nodo_raiz.to_dict(self.catalogo)
             if 'atributo' in dict_para_guardar:
                 del dict_para_guardar['atributo']
             obj[nombre_maquina] = dict_para_guardar
-        data = json.dumps(obj, indent=2, ensure_ascii=False)
+        return obj
+
+    def to_json(self, filename: Optional[Path] = None):
+        path = filename or self.archivo_path
+        data = json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+        data = _LISTA_IDS.sub(
+            lambda m: m.group(1) + "[" + ", ".join(i.strip() for i in m.group(2).split(",")) + "]",
+            data
+        )
         with open(path, 'w', encoding='utf8') as f:
             f.write(data)
         return data
 
+    def _completar_catalogo(self):
+        """
+        Registra en el catálogo los textos de hojas que aún no tienen ID.
+        Las entradas sin uso no se quitan: los sitios que heredan de esta base
+        (cargados o no) pueden apuntar a ellas desde sus propios JSON.
+        """
+        for nodo_raiz in self.maquinas.values():
+            for nodo in nodo_raiz.recorrer():
+                for solucion in nodo.soluciones:
+                    self.catalogo.id_solucion(solucion)
+                if nodo.referencia:
+                    self.catalogo.id_referencia(nodo.referencia)
+
+    def _guardar(self):
+        if self.persistir:
+            self.to_json()
+        else:
+            # Sin escribir el archivo, igual se registran los textos nuevos para
+            # que los IDs coincidan con los del primario.
+            self._completar_catalogo()
+
+    # ------------- REPLICACIÓN ----------------------------
+    def instantanea(self) -> dict:
+        """Estado completo junto con la posición del registro, tomados atómicamente."""
+        with self._lock:
+            return {"seq": self.registro.seq, "epoca": self.registro.epoca, "base": self.to_dict()}
+
+    def cargar_instantanea(self, instantanea: dict):
+        with self._lock:
+            self.from_dict(instantanea["base"])
+            self.registro.reiniciar(instantanea["seq"], instantanea["epoca"])
+            self._guardar()
+
+    def aplicar_operacion(self, entrada: dict):
+        """Aplica una entrada del registro de otro nodo, que debe ser la siguiente en la secuencia."""
+        with self._lock:
+            if entrada["seq"] != self.registro.seq + 1:
+                raise ValueError(f"Operación fuera de orden: se esperaba {self.registro.seq + 1}, llegó {entrada['seq']}.")
+            if entrada["op"] not in OPERACIONES_REPLICABLES:
+                raise ValueError(f"Operación desconocida en el registro: '{entrada['op']}'.")
+            getattr(self, entrada["op"])(**copy.deepcopy(entrada["args"]))
+
     # ------------- CONSULTA ----------------------------
     def listar_maquinas(self) -> List[str]:
-        return list(self.maquinas.keys())
+        heredadas = self.padre.listar_maquinas() if self.padre else []
+        return heredadas + [m for m in self.maquinas if m not in heredadas]
 
     def get_arbol_maquina(self, nombre_maquina: str) -> Optional[Nodo]:
         nodo = self.maquinas.get(nombre_maquina)
+        if not nodo and self.padre:
+            return self.padre.get_arbol_maquina(nombre_maquina)
         if not nodo:
             raise ValueError(f"No se encontró la máquina: {nombre_maquina}")
         return nodo
 
+    def catalogo_de(self, nombre_maquina: str) -> Catalogo:
+        """Catálogo de la base dueña de la máquina (la propia o una heredada)."""
+        if nombre_maquina not in self.maquinas and self.padre:
+            return self.padre.catalogo_de(nombre_maquina)
+        return self.catalogo
+
+    def catalogo_combinado(self) -> dict:
+        """Catálogo propio más el de las bases heredadas (los IDs no chocan por el 'espacio')."""
+        combinado = self.padre.catalogo_combinado() if self.padre else {"soluciones": {}, "referencias": {}}
+        propio = self.catalogo.to_dict()
+        combinado["soluciones"].update(propio["soluciones"])
+        combinado["referencias"].update(propio["referencias"])
+        return combinado
+
+    def version_catalogo(self) -> str:
+        version = self.catalogo.version()
+        return f"{self.padre.version_catalogo()}.{version[:16]}" if self.padre else version
+
     def find_nodo_by_path(self, nombre_maquina: str, path: List[str]) -> Optional[Nodo]:
         nodo_actual = self.get_arbol_maquina(nombre_maquina)
         if nodo_actual is None:
@@ -82,44 +251,100 @@ class BaseConocimiento:
 
     # ------------- EDICIÓN (con restructuración explícita) ----------------------------
 
+    def _copiar_si_heredada(self, nombre_maquina: str):
+        """
+        Copia-en-escritura: antes de editar una máquina heredada se copia su
+        árbol a esta base, así la edición no toca la base compartida. Las hojas
+        copiadas siguen apuntando a los IDs del catálogo heredado.
+        """
+        if nombre_maquina in self.maquinas or not self.padre:
+            return
+        original = self.padre.get_arbol_maquina(nombre_maquina)
+        self.maquinas[nombre_maquina] = Nodo.from_dict(original.to_dict(), self.catalogo)
+
+    @replicable
     def agregar_maquina(self, nombre_maquina: str) -> bool:
-        if nombre_maquina in self.maquinas:
+        if nombre_maquina in self.listar_maquinas():
             raise ValueError(f"La máquina '{nombre_maquina}' ya existe.")
         self.maquinas[nombre_maquina] = Nodo(
             nombre=nombre_maquina,
             pregunta=f"¿Cuál es el síntoma principal de {nombre_maquina}?"
         )
-        self.to_json()
+        self._guardar()
         return True
 
+    @replicable
     def agregar_rama(self, nombre_maquina: str, path_padre: List[str], nuevo_nodo_dict: dict) -> bool:
+        self._copiar_si_heredada(nombre_maquina)
         nodo_padre = self.find_nodo_by_path(nombre_maquina, path_padre)
         if nodo_padre is None:
             raise ValueError("El path (ruta) al nodo padre no existe.")
         # Permite agregar ramas únicamente a nodos de pregunta ("ramas" debe existir)
         if nodo_padre.es_hoja():
             raise ValueError("No se puede agregar una rama a un nodo que es una falla. Use restructuración para dividir el nodo.")
-        nuevo_nodo = Nodo.from_dict(nuevo_nodo_dict)
+        nuevo_nodo = Nodo.from_dict(nuevo_nodo_dict, self.catalogo)
         if not nuevo_nodo.nombre:
             raise ValueError("El nuevo síntoma o falla debe tener un 'atributo' (nombre).")
         if nodo_padre.find_rama_by_nombre(nuevo_nodo.nombre):
             raise ValueError(f"El síntoma/atributo '{nuevo_nodo.nombre}' ya existe en este nivel.")
         nodo_padre.agregar_rama(nuevo_nodo)
-        self.to_json()
+        self._guardar()
         return True
 
+    @replicable
     def agregar_solucion(self, nombre_maquina: str, path_a_falla: List[str], nueva_solucion: str) -> bool:
+        self._copiar_si_heredada(nombre_maquina)
         nodo_falla = self.find_nodo_by_path(nombre_maquina, path_a_falla)
         if nodo_falla is None:
             raise ValueError("El path (ruta) al nodo de falla no existe.")
         if not nodo_falla.es_hoja():
             raise ValueError("El nodo seleccionado no es un nodo de falla.")
         if nueva_solucion not in nodo_falla.soluciones:
-            nodo_falla.soluciones.append(nueva_solucion)
-            self.to_json()
+            id_solucion = self.catalogo.registrar_solucion(nueva_solucion)
+            nodo_falla.soluciones.append(self.catalogo.solucion(id_solucion))
+            self._guardar()
             return True
         raise ValueError("La solución ya existe para esta falla.")
 
+    @replicable
+    def editar_solucion_catalogo(self, id_solucion: str, texto_nuevo: str) -> int:
+        """
+        Edita una solución del catálogo compartido.
+        El cambio se aplica a todas las fallas (de todas las máquinas) que la usan.
+        Devuelve la cantidad de fallas actualizadas.
+        """
+        texto_anterior = self.catalogo.editar_solucion(id_solucion, texto_nuevo)
+        texto_nuevo = self.catalogo.solucion(id_solucion)
+        actualizadas = self._reemplazar_solucion(texto_anterior, texto_nuevo)
+        self._guardar()
+        # Los sitios cargados que heredan de esta base ven la edición en sus
+        # máquinas copiadas (los no cargados la leen del catálogo al cargarse)
+        for hija in list(self.hijas):
+            actualizadas += hija._heredar_edicion_solucion(texto_anterior, texto_nuevo)
+        return actualizadas
+
+    def _reemplazar_solucion(self, texto_anterior: str, texto_nuevo: str) -> int:
+        actualizadas = 0
+        for nodo_raiz in self.maquinas.values():
+            for nodo in nodo_raiz.recorrer():
+                if texto_anterior in nodo.soluciones:
+                    nodo.soluciones = [texto_nuevo if s == texto_anterior else s for s in nodo.soluciones]
+                    actualizadas += 1
+        return actualizadas
+
+    def _heredar_edicion_solucion(self, texto_anterior: str, texto_nuevo: str) -> int:
+        """La base heredada editó una solución de su catálogo: se actualizan las hojas copiadas."""
+        with self._lock:
+            if self.descargada:
+                return 0
+            actualizadas = self._reemplazar_solucion(texto_anterior, texto_nuevo)
+            if actualizadas:
+                self._guardar()
+            for hija in list(self.hijas):
+                actualizadas += hija._heredar_edicion_solucion(texto_anterior, texto_nuevo)
+            return actualizadas
+
+    @replicable
     def restructurar_falla_a_pregunta(
         self,
         nombre_maquina: str,
@@ -137,7 +362,8 @@ class BaseConocimiento:
         - Dos hijos/ramas hoja: una con los datos de la falla anterior, otra con la falla nueva.
         """
 
-        # 1. Buscar el nodo hoja a restructurar
+        # 1. Buscar el nodo hoja a restructurar (copiando la máquina si es heredada)
+        self._copiar_si_heredada(nombre_maquina)
         nodo = self.find_nodo_by_path(nombre_maquina, path_a_hoja)
         if not nodo:
             raise ValueError("No se encontró el nodo hoja a restructurar.")
@@ -163,13 +389,13 @@ class BaseConocimiento:
 
         # 4. Agregar ramas con nuevas opciones/atributos (ambas hojas)
         falla_existente_dict["atributo"] = atributo_existente
-        rama_vieja = Nodo.from_dict(falla_existente_dict)
+        rama_vieja = Nodo.from_dict(falla_existente_dict, self.catalogo)
         falla_nueva_dict["atributo"] = atributo_nuevo
-        rama_nueva = Nodo.from_dict(falla_nueva_dict)
+        rama_nueva = Nodo.from_dict(falla_nueva_dict, self.catalogo)
 
         nodo.agregar_rama(rama_vieja)
         nodo.agregar_rama(rama_nueva)
 
-        self.to_json()
+        self._guardar()
         return True
 
@@ -0,0 +1,178 @@
+"""
+catalogo.py
+Catálogo compartido de soluciones y referencias de la base de conocimientos.
+Cada texto se guarda una sola vez (internado) bajo un ID estable, y las hojas
+del árbol apuntan a esos IDs en el JSON.
+"""
+
+import hashlib
+import json
+import sys
+from typing import Callable, Dict, Optional
+
+PREFIJO_SOLUCION = "S"
+PREFIJO_REFERENCIA = "R"
+
+
+def internar(texto: Optional[str]) -> Optional[str]:
+    """Devuelve la copia internada del texto (o None si no hay texto)."""
+    if texto is None:
+        return None
+    return sys.intern(texto)
+
+
+class Catalogo:
+    """
+    Diccionario bidireccional ID <-> texto para soluciones y referencias.
+    Los IDs son secuenciales por tipo ("S1", "S2", ..., "R1", ...) y no cambian
+    al editar el texto, por lo que todas las fallas que comparten una solución
+    ven la edición. El contador se guarda en el JSON ("siguiente"): un ID nunca
+    se reutiliza para otro texto. 'espacio' antepone un prefijo a los IDs (ej. "acme.S1") para
+    que los catálogos de sitios superpuestos no choquen con el de la base.
+    'heredado' devuelve el catálogo de la base de la que hereda un sitio: los
+    textos se buscan primero allí y sólo los nuevos se registran en este.
+    """
+    def __init__(self, espacio: str = "", heredado: Optional[Callable[[], Optional['Catalogo']]] = None):
+        self.espacio = espacio
+        self.heredado = heredado
+        self.soluciones: Dict[str, str] = {}
+        self.referencias: Dict[str, str] = {}
+        self._id_por_solucion: Dict[str, str] = {}
+        self._id_por_referencia: Dict[str, str] = {}
+        self._siguiente: Dict[str, int] = {PREFIJO_SOLUCION: 1, PREFIJO_REFERENCIA: 1}
+
+    # ------------ REGISTRO ----------------
+    def _numero(self, id_entrada: str, prefijo: str) -> int:
+        sufijo = id_entrada[len(self.espacio + prefijo):]
+        return int(sufijo) if id_entrada.startswith(self.espacio + prefijo) and sufijo.isdigit() else 0
+
+    def _registrar(self, texto: str, prefijo: str, tabla: Dict[str, str], inverso: Dict[str, str]) -> str:
+        texto = internar(texto)
+        id_existente = inverso.get(texto)
+        if id_existente is not None:
+            return id_existente
+        nuevo_id = f"{self.espacio}{prefijo}{self._siguiente[prefijo]}"
+        while nuevo_id in tabla:
+            self._siguiente[prefijo] += 1
+            nuevo_id = f"{self.espacio}{prefijo}{self._siguiente[prefijo]}"
+        self._siguiente[prefijo] += 1
+        tabla[nuevo_id] = texto
+        inverso[texto] = nuevo_id
+        return nuevo_id
+
+    def registrar_solucion(self, texto: str) -> str:
+        return self.buscar_solucion(texto) or self._registrar(
+            texto, PREFIJO_SOLUCION, self.soluciones, self._id_por_solucion)
+
+    def registrar_referencia(self, texto: str) -> str:
+        return self.buscar_referencia(texto) or self._registrar(
+            texto, PREFIJO_REFERENCIA, self.referencias, self._id_por_referencia)
+
+    # ------------ CONSULTA ----------------
+    def _padre(self) -> Optional['Catalogo']:
+        return self.heredado() if self.heredado else None
+
+    def solucion(self, id_solucion: str) -> str:
+        texto = self.soluciones.get(id_solucion)
+        padre = self._padre()
+        if texto is None and padre is not None:
+            return padre.solucion(id_solucion)
+        if texto is None:
+            raise ValueError(f"No se encontró la solución con ID '{id_solucion}' en el catálogo.")
+        return texto
+
+    def referencia(self, id_referencia: str) -> str:
+        texto = self.referencias.get(id_referencia)
+        padre = self._padre()
+        if texto is None and padre is not None:
+            return padre.referencia(id_referencia)
+        if texto is None:
+            raise ValueError(f"No se encontró la referencia con ID '{id_referencia}' en el catálogo.")
+        return texto
+
+    def buscar_solucion(self, texto: str) -> Optional[str]:
+        """ID de la solución, o None si el texto no está en el catálogo. Nunca registra."""
+        padre = self._padre()
+        return (padre.buscar_solucion(texto) if padre is not None else None) or self._id_por_solucion.get(texto)
+
+    def buscar_referencia(self, texto: str) -> Optional[str]:
+        """ID de la referencia, o None si el texto no está en el catálogo. Nunca registra."""
+        padre = self._padre()
+        return (padre.buscar_referencia(texto) if padre is not None else None) or self._id_por_referencia.get(texto)
+
+    def id_solucion(self, texto: str) -> str:
+        """
+        ID de una solución ya presente en el árbol (la registra si hiciera falta).
+        Sólo para serializar bajo el lock de la base: en lecturas, use buscar_solucion.
+        """
+        return self._id_por_solucion.get(texto) or self.registrar_solucion(texto)
+
+    def id_referencia(self, texto: str) -> str:
+        """
+        ID de una referencia ya presente en el árbol (la registra si hiciera falta).
+        Sólo para serializar bajo el lock de la base: en lecturas, use buscar_referencia.
+        """
+        return self._id_por_referencia.get(texto) or self.registrar_referencia(texto)
+
+    # ------------ EDICIÓN ----------------
+    def editar_solucion(self, id_solucion: str, texto_nuevo: str) -> str:
+        """
+        Cambia el texto de una solución manteniendo su ID.
+        Devuelve el texto anterior para que el llamador actualice las hojas.
+        """
+        if id_solucion not in self.soluciones and self._padre() is not None:
+            self._padre().solucion(id_solucion)
+            raise ValueError(f"La solución '{id_solucion}' es heredada: edítela en la base de la que hereda el sitio.")
+        texto_anterior = self.solucion(id_solucion)
+        texto_nuevo = internar(texto_nuevo)
+        id_duplicado = self._id_por_solucion.get(texto_nuevo)
+        if id_duplicado is not None and id_duplicado != id_solucion:
+            raise ValueError(f"El texto ya existe en el catálogo como la solución '{id_duplicado}'.")
+        del self._id_por_solucion[texto_anterior]
+        self.soluciones[id_solucion] = texto_nuevo
+        self._id_por_solucion[texto_nuevo] = id_solucion
+        return texto_anterior
+
+    # ------------ SERIALIZACIÓN ----------------
+    def to_dict(self) -> dict:
+        return {
+            "soluciones": dict(self.soluciones),
+            "referencias": dict(self.referencias),
+            "siguiente": {
+                "soluciones": self._siguiente[PREFIJO_SOLUCION],
+                "referencias": self._siguiente[PREFIJO_REFERENCIA],
+            },
+        }
+
+    def copia(self) -> 'Catalogo':
+        """Copia independiente, para deshacer una edición fallida."""
+        return Catalogo.from_dict(self.to_dict(), self.espacio, self.heredado)
+
+    @staticmethod
+    def from_dict(
+        data: Optional[dict],
+        espacio: str = "",
+        heredado: Optional[Callable[[], Optional['Catalogo']]] = None
+    ) -> 'Catalogo':
+        catalogo = Catalogo(espacio, heredado)
+        data = data or {}
+        for id_solucion, texto in data.get("soluciones", {}).items():
+            texto = internar(texto)
+            catalogo.soluciones[id_solucion] = texto
+            catalogo._id_por_solucion.setdefault(texto, id_solucion)
+        for id_referencia, texto in data.get("referencias", {}).items():
+            texto = internar(texto)
+            catalogo.referencias[id_referencia] = texto
+            catalogo._id_por_referencia.setdefault(texto, id_referencia)
+        # Archivos sin "siguiente": se continúa desde el mayor ID existente
+        siguiente = data.get("siguiente", {})
+        catalogo._siguiente[PREFIJO_SOLUCION] = siguiente.get("soluciones") or 1 + max(
+            (catalogo._numero(i, PREFIJO_SOLUCION) for i in catalogo.soluciones), default=0)
+        catalogo._siguiente[PREFIJO_REFERENCIA] = siguiente.get("referencias") or 1 + max(
+            (catalogo._numero(i, PREFIJO_REFERENCIA) for i in catalogo.referencias), default=0)
+        return catalogo
+
+    def version(self) -> str:
+        """Huella del contenido, usada como ETag para cachear el catálogo en el cliente."""
+        data = json.dumps(self.to_dict(), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(data.encode("utf8")).hexdigest()
@@ -14,8 +14,10 @@ class MotorInferencia:
     procesando respuestas (atributos) hasta detectar la falla.
     """
 
-    def __init__(self, base: BaseConocimiento):
+    def __init__(self, base: BaseConocimiento, incluir_ids: bool = False):
         self.base = base
+        # Si es True, los resultados envían IDs del catálogo en lugar de textos
+        self.incluir_ids = incluir_ids
         self.maquina_actual: Optional[str] = None
         self.nodo_actual: Optional[Nodo] = None
         self.ruta: List[Nodo] = []
@@ -97,7 +99,30 @@ class MotorInferencia:
     def _resultado_final(self, nodo_falla: Nodo) -> dict:
         """
         Devuelve el resultado final del diagnóstico (una hoja).
+        Con 'incluir_ids', soluciones y referencia van como IDs del catálogo
+        (ver GET /api/catalogo); lo que no esté en el catálogo va como texto
+        en "soluciones"/"referencia".
         """
+        if self.incluir_ids:
+            # Sólo consulta el catálogo: registrar aquí avanzaría los contadores de IDs
+            # fuera del lock y del registro de ediciones (la sesión puede ser anterior
+            # a una edición del texto).
+            catalogo = self.base.catalogo_de(self.maquina_actual)
+            resultado = {"falla": nodo_falla.falla, "soluciones_ids": [], "referencia_id": None}
+            sin_id = []
+            for solucion in nodo_falla.soluciones:
+                id_solucion = catalogo.buscar_solucion(solucion)
+                if id_solucion is None:
+                    sin_id.append(solucion)
+                else:
+                    resultado["soluciones_ids"].append(id_solucion)
+            if sin_id:
+                resultado["soluciones"] = sin_id
+            if nodo_falla.referencia:
+                resultado["referencia_id"] = catalogo.buscar_referencia(nodo_falla.referencia)
+                if resultado["referencia_id"] is None:
+                    resultado["referencia"] = nodo_falla.referencia
+            return resultado
         return {
             "falla": nodo_falla.falla,
             "soluciones": nodo_falla.soluciones,
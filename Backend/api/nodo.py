@@ -3,7 +3,9 @@ nodo.py
 Define la clase Nodo, adaptada a la nueva estructura simplificada.
 """
 
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Iterator
+
+from Backend.api.catalogo import Catalogo, internar
 
 class Nodo:
     """
@@ -21,11 +23,11 @@ class Nodo:
         soluciones: Optional[List[str]] = None,
         referencia: Optional[str] = None
     ):
-        self.nombre = nombre or ""
-        self.pregunta = pregunta
-        self.falla = falla
-        self.soluciones = soluciones or []
-        self.referencia = referencia
+        self.nombre = internar(nombre) or ""
+        self.pregunta = internar(pregunta)
+        self.falla = internar(falla)
+        self.soluciones = [internar(s) for s in soluciones or []]
+        self.referencia = internar(referencia)
         self.ramas: List['Nodo'] = []
 
     def agregar_rama(self, nodo_hijo: 'Nodo'):
@@ -45,9 +47,19 @@ class Nodo:
                 return rama
         return None
 
-    def to_dict(self) -> dict:
+    def recorrer(self) -> Iterator['Nodo']:
+        """Recorre el nodo y todos sus descendientes (preorden)."""
+        pendientes = [self]
+        while pendientes:
+            nodo = pendientes.pop()
+            yield nodo
+            pendientes.extend(reversed(nodo.ramas))
+
+    def to_dict(self, catalogo: Optional[Catalogo] = None) -> dict:
         """
         Convierte el Nodo y sus ramas a un dict para guardar como JSON.
+        Con un catálogo, las soluciones y la referencia se guardan como IDs
+        ("soluciones_ids", "referencia_id").
         """
         obj: Dict[str, Any] = {}
 
@@ -59,31 +71,50 @@ class Nodo:
         if self.falla:
             obj["falla"] = self.falla
         if self.soluciones:
-            obj["soluciones"] = self.soluciones
+            if catalogo is not None:
+                obj["soluciones_ids"] = [catalogo.id_solucion(s) for s in self.soluciones]
+            else:
+                obj["soluciones"] = self.soluciones
         if self.referencia:
-            obj["referencia"] = self.referencia
+            if catalogo is not None:
+                obj["referencia_id"] = catalogo.id_referencia(self.referencia)
+            else:
+                obj["referencia"] = self.referencia
         if self.ramas:
-            obj["ramas"] = [rama.to_dict() for rama in self.ramas]
+            obj["ramas"] = [rama.to_dict(catalogo) for rama in self.ramas]
 
         return obj
 
     @staticmethod
-    def from_dict(data: dict) -> 'Nodo':
+    def from_dict(data: dict, catalogo: Optional[Catalogo] = None) -> 'Nodo':
         """
         Crea un árbol de Nodos a partir de un dict (base_conocimiento.json).
+        Si se pasa un catálogo, se resuelven "soluciones_ids"/"referencia_id" y
+        los textos sueltos se registran en él, así todas las hojas comparten
+        la misma instancia de cada texto.
         """
         # "atributo" es el texto de la opción seleccionable.
         nombre_nodo = data.get("atributo") or data.get("nombre")  # raíz puede no tener atributo
 
+        soluciones = list(data.get("soluciones") or [])
+        referencia = data.get("referencia")
+        if catalogo is not None:
+            soluciones = [catalogo.solucion(i) for i in data.get("soluciones_ids", [])] + soluciones
+            if data.get("referencia_id"):
+                referencia = catalogo.referencia(data["referencia_id"])
+            soluciones = [catalogo.solucion(catalogo.registrar_solucion(s)) for s in soluciones]
+            if referencia:
+                referencia = catalogo.referencia(catalogo.registrar_referencia(referencia))
+
         nodo = Nodo(
             nombre=nombre_nodo,
             pregunta=data.get("pregunta"),
             falla=data.get("falla"),
-            soluciones=data.get("soluciones", []),
-            referencia=data.get("referencia")
+            soluciones=soluciones,
+            referencia=referencia
         )
         for rama_data in data.get("ramas", []):
-            nodo.agregar_rama(Nodo.from_dict(rama_data))
+            nodo.agregar_rama(Nodo.from_dict(rama_data, catalogo))
         return nodo
 
     def __repr__(self):
@@ -0,0 +1,356 @@
+"""
+perfilado.py
+Perfilado bajo demanda de las rutas de la API.
+Un administrador arma el perfilador para las próximas N solicitudes (o las que
+coincidan con un patrón de ruta) y las pilas se agregan en formato "collapsed"
+(una línea "a;b;c peso" por pila), listo para generar un flame graph.
+Desactivado, el costo por solicitud es una comprobación de un booleano (y de
+una ContextVar por cada dependencia o endpoint síncrono).
+"""
+
+import functools
+import inspect
+import re
+import sys
+import threading
+import time
+import warnings
+from collections import Counter
+from contextvars import ContextVar
+from html import escape
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+try:
+    # FastAPI >= 0.14x arma, al incluir un router, un 'dependant' propio por
+    # inclusión y llama a get_route_handler() con este contexto activo. Es
+    # interno de FastAPI: la versión está fijada en requirements.txt.
+    from fastapi.routing import _effective_route_context_var
+except ImportError:  # versiones que copian la ruta en include_router
+    _effective_route_context_var = None
+    warnings.warn(
+        "perfilado: fastapi.routing._effective_route_context_var no existe en esta versión de FastAPI; "
+        "si include_router arma su propio 'dependant', las dependencias y el endpoint no se perfilarán. "
+        "Use la versión de requirements.txt."
+    )
+
+MODO_MUESTREO = "muestreo"
+MODO_DETERMINISTA = "determinista"
+MODOS = (MODO_MUESTREO, MODO_DETERMINISTA)
+
+
+def _etiqueta(code) -> str:
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class _Solicitud:
+    """Lo medido en una solicitud perfilada."""
+    def __init__(self, ruta: str, modo: str, generacion: int):
+        self.ruta = ruta
+        self.modo = modo
+        self.generacion = generacion
+        self.pesos: Counter = Counter()
+        self.muestras = 0
+
+
+# Solicitud perfilada en curso; FastAPI la propaga a los hilos del threadpool
+_solicitud_actual: ContextVar[Optional[_Solicitud]] = ContextVar("perfilado_solicitud", default=None)
+
+
+class Perfilador:
+    """
+    Estado global del perfilado.
+    - "muestreo": un hilo toma la pila de los hilos que atienden solicitudes
+      perfiladas cada 'intervalo_ms' (y una al entrar a cada llamada); el peso
+      es la cantidad de muestras.
+    - "determinista": sys.setprofile en cada dependencia y endpoint síncrono;
+      el peso es el tiempo propio de cada pila en microsegundos.
+    """
+    def __init__(self):
+        self.activo = False
+        self.modo = MODO_MUESTREO
+        self.restantes = 0
+        self.patron: Optional[re.Pattern] = None
+        self.intervalo_ms = 5.0
+        self.perfiladas = 0
+        self.pilas: Counter = Counter()
+        self._lock = threading.Lock()
+        self._hilos: Dict[int, _Solicitud] = {}
+        self._en_curso = 0
+        # Cambia al activar o desactivar: las solicitudes de un armado anterior no devuelven cupo
+        self._generacion = 0
+        self._muestreador: Optional[threading.Thread] = None
+
+    # ------------ CONTROL ----------------
+    def activar(self, modo: str, solicitudes: int, patron: Optional[str] = None, intervalo_ms: float = 5.0):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de perfilado inválido: '{modo}'. Use uno de {MODOS}.")
+        if solicitudes < 1:
+            raise ValueError("La cantidad de solicitudes a perfilar debe ser al menos 1.")
+        try:
+            patron_compilado = re.compile(patron) if patron else None
+        except re.error as e:
+            raise ValueError(f"Patrón de ruta inválido: {e}")
+        with self._lock:
+            self.modo = modo
+            self.restantes = solicitudes
+            self.patron = patron_compilado
+            self.intervalo_ms = intervalo_ms
+            self.activo = True
+            self._generacion += 1
+            self._asegurar_muestreador()
+
+    def desactivar(self):
+        with self._lock:
+            self._generacion += 1
+            self.activo = False
+            self.restantes = 0
+
+    def limpiar(self):
+        with self._lock:
+            self.pilas.clear()
+            self.perfiladas = 0
+
+    def estado(self) -> Dict[str, Any]:
+        return {
+            "activo": self.activo,
+            "modo": self.modo,
+            "restantes": self.restantes,
+            "patron": self.patron.pattern if self.patron else None,
+            "intervalo_ms": self.intervalo_ms,
+            "perfiladas": self.perfiladas,
+            "pilas": len(self.pilas),
+        }
+
+    def _tomar(self, ruta: str) -> Optional["_Solicitud"]:
+        """Decide si perfilar esta solicitud y descuenta una del cupo."""
+        with self._lock:
+            if not self.activo or (self.patron and not self.patron.search(ruta)):
+                return None
+            self.restantes -= 1
+            if self.restantes <= 0:
+                self.activo = False
+            self.perfiladas += 1
+            self._en_curso += 1
+            return _Solicitud(ruta, self.modo, self._generacion)
+
+    def _cerrar(self, solicitud: "_Solicitud", total_ns: int):
+        """
+        Vuelca lo medido en las pilas globales. Una solicitud que no dejó
+        ninguna muestra se devuelve al cupo, así N solicitudes armadas
+        siempre producen datos.
+        """
+        with self._lock:
+            self._en_curso -= 1
+            if solicitud.modo == MODO_DETERMINISTA and solicitud.pesos:
+                # Lo no atribuido a llamadas síncronas es trabajo del framework
+                # (validación, serialización) y queda como tiempo propio de la ruta.
+                propio = total_ns - sum(solicitud.pesos.values())
+                solicitud.pesos[solicitud.ruta] += max(propio, 0)
+                for clave, ns in solicitud.pesos.items():
+                    if ns >= 1000:
+                        self.pilas[clave] += ns // 1000
+            elif solicitud.muestras == 0 and solicitud.generacion == self._generacion:
+                self.perfiladas -= 1
+                self.restantes += 1
+                self.activo = True
+                self._asegurar_muestreador()
+
+    def _asegurar_muestreador(self):
+        if self.modo == MODO_MUESTREO and not (self._muestreador and self._muestreador.is_alive()):
+            self._muestreador = threading.Thread(target=self._muestrear, name="perfilador", daemon=True)
+            self._muestreador.start()
+
+    # ------------ EJECUCIÓN ----------------
+    async def ejecutar_solicitud(self, ruta: str, manejador: Callable, request):
+        """Mide la solicitud completa: dependencias, validación, endpoint y respuesta."""
+        solicitud = self._tomar(ruta)
+        if solicitud is None:
+            return await manejador(request)
+        token = _solicitud_actual.set(solicitud)
+        inicio = time.perf_counter_ns()
+        try:
+            return await manejador(request)
+        finally:
+            _solicitud_actual.reset(token)
+            self._cerrar(solicitud, time.perf_counter_ns() - inicio)
+
+    def ejecutar_llamada(self, solicitud: "_Solicitud", llamada: Callable, *args, **kwargs):
+        """Ejecuta una dependencia o endpoint síncrono de una solicitud perfilada (en su hilo)."""
+        if solicitud.modo == MODO_DETERMINISTA:
+            return self._ejecutar_determinista(solicitud, llamada, *args, **kwargs)
+        hilo = threading.get_ident()
+        with self._lock:
+            self._hilos[hilo] = solicitud
+        # Una muestra al entrar: incluso una llamada más corta que el intervalo aparece
+        self._registrar_muestra(solicitud, None, hoja=_etiqueta(llamada.__code__))
+        try:
+            return llamada(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._hilos.pop(hilo, None)
+
+    def _ejecutar_determinista(self, solicitud: "_Solicitud", llamada: Callable, *args, **kwargs):
+        pila: List[str] = [solicitud.ruta]
+        pesos: Counter = Counter()
+        ultimo = [time.perf_counter_ns()]
+
+        def perfil(frame, evento, arg):
+            if arg is sys.setprofile:
+                # La llamada que desactiva este perfil no es parte de la solicitud
+                return
+            ahora = time.perf_counter_ns()
+            pesos[";".join(pila)] += ahora - ultimo[0]
+            if evento == "call":
+                pila.append(_etiqueta(frame.f_code))
+            elif evento == "c_call":
+                pila.append(f"{getattr(arg, '__qualname__', repr(arg))} (builtin)")
+            elif evento in ("return", "c_return", "c_exception") and len(pila) > 1:
+                pila.pop()
+            ultimo[0] = time.perf_counter_ns()
+
+        anterior = sys.getprofile()
+        sys.setprofile(perfil)
+        try:
+            return llamada(*args, **kwargs)
+        finally:
+            sys.setprofile(anterior)
+            pesos[";".join(pila)] += time.perf_counter_ns() - ultimo[0]
+            with self._lock:
+                solicitud.pesos.update(pesos)
+
+    def _registrar_muestra(self, solicitud: "_Solicitud", frame, hoja: Optional[str] = None):
+        """Agrega la pila del frame, recortada en ejecutar_llamada y con la ruta como raíz."""
+        etiquetas = [hoja] if hoja else []
+        while frame is not None and frame.f_code is not _CODIGO_LLAMADA:
+            etiquetas.append(_etiqueta(frame.f_code))
+            frame = frame.f_back
+        etiquetas.append(solicitud.ruta)
+        with self._lock:
+            self.pilas[";".join(reversed(etiquetas))] += 1
+            solicitud.muestras += 1
+
+    def _muestrear(self):
+        propio = threading.get_ident()
+        while True:
+            with self._lock:
+                hilos = dict(self._hilos)
+                if not self._en_curso and not (self.activo and self.modo == MODO_MUESTREO):
+                    self._muestreador = None
+                    return
+            intervalo = self.intervalo_ms / 1000
+            if hilos:
+                frames = sys._current_frames()
+                for hilo, solicitud in hilos.items():
+                    frame = frames.get(hilo)
+                    if hilo != propio and frame is not None:
+                        self._registrar_muestra(solicitud, frame)
+            time.sleep(intervalo)
+
+    # ------------ SALIDA ----------------
+    def collapsed(self) -> str:
+        with self._lock:
+            return "".join(f"{pila} {peso}\n" for pila, peso in sorted(self.pilas.items()))
+
+    def flamegraph_svg(self, ancho: int = 1200, alto_fila: int = 16) -> str:
+        """Renderiza las pilas agregadas como un flame graph SVG simple."""
+        with self._lock:
+            pilas = dict(self.pilas)
+        arbol: Dict[str, Any] = {"peso": 0, "hijos": {}}
+        for pila, peso in pilas.items():
+            arbol["peso"] += peso
+            nodo = arbol
+            for etiqueta in pila.split(";"):
+                nodo = nodo["hijos"].setdefault(etiqueta, {"peso": 0, "hijos": {}})
+                nodo["peso"] += peso
+
+        rects: List[tuple] = []
+        profundidad_max = [0]
+
+        def dibujar(hijos: Dict[str, Any], x: float, profundidad: int, escala: float):
+            profundidad_max[0] = max(profundidad_max[0], profundidad)
+            for etiqueta, nodo in sorted(hijos.items()):
+                w = nodo["peso"] * escala
+                if w >= 0.5:
+                    rects.append((x, profundidad, w, etiqueta, nodo["peso"]))
+                    dibujar(nodo["hijos"], x, profundidad + 1, escala)
+                x += w
+
+        escala = ancho / arbol["peso"] if arbol["peso"] else 0
+        dibujar(arbol["hijos"], 0.0, 0, escala)
+        alto = (profundidad_max[0] + 1) * alto_fila
+        partes = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{ancho}" height="{alto}" '
+                  f'font-family="monospace" font-size="11">']
+        for x, profundidad, w, etiqueta, peso in rects:
+            y = alto - (profundidad + 1) * alto_fila
+            color = 200 + (hash(etiqueta) % 55)
+            texto = escape(etiqueta)
+            partes.append(
+                f'<g><title>{texto} ({peso})</title>'
+                f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{alto_fila - 1}" fill="rgb({color},{color // 2},0)"/>'
+                f'<text x="{x + 2:.1f}" y="{y + alto_fila - 4}">{texto[:max(int(w // 7), 0)]}</text></g>'
+            )
+        partes.append("</svg>")
+        return "\n".join(partes)
+
+
+perfilador = Perfilador()
+
+
+_CODIGO_LLAMADA = Perfilador.ejecutar_llamada.__code__
+
+# Envolturas por función original: FastAPI cachea dependencias por 'call', así
+# que la misma dependencia debe quedar envuelta por el mismo objeto en todas las rutas.
+_envolturas: Dict[Callable, Callable] = {}
+
+
+def _envolver(llamada: Callable) -> Callable:
+    envoltura = _envolturas.get(llamada)
+    if envoltura is None:
+        @functools.wraps(llamada)
+        def envoltura(*args, **kwargs):
+            solicitud = _solicitud_actual.get()
+            if solicitud is None:
+                return llamada(*args, **kwargs)
+            return perfilador.ejecutar_llamada(solicitud, llamada, *args, **kwargs)
+        envoltura._perfilable = True
+        _envolturas[llamada] = envoltura
+    return envoltura
+
+
+def _envolver_dependencias(dependant):
+    """Envuelve el endpoint y las dependencias síncronas (se ejecutan en el threadpool)."""
+    llamada = dependant.call
+    if (
+        inspect.isfunction(llamada)
+        and not getattr(llamada, "_perfilable", False)
+        and not inspect.iscoroutinefunction(llamada)
+        and not inspect.isgeneratorfunction(llamada)
+    ):
+        dependant.call = _envolver(llamada)
+    for sub in dependant.dependencies:
+        _envolver_dependencias(sub)
+
+
+class RutaPerfilable(APIRoute):
+    """
+    APIRoute que perfila la solicitud completa cuando el perfilador está armado.
+    El manejador mide el total; las dependencias y el endpoint síncronos, que
+    FastAPI ejecuta en hilos del threadpool, se perfilan o muestrean en su hilo.
+    """
+    def get_route_handler(self) -> Callable:
+        contexto = _effective_route_context_var.get() if _effective_route_context_var else None
+        if contexto is not None and contexto.original_route is self:
+            _envolver_dependencias(contexto.dependant)
+        else:
+            _envolver_dependencias(self.dependant)
+        manejador = super().get_route_handler()
+        ruta = self.path
+
+        async def manejador_perfilado(request):
+            if not perfilador.activo:
+                return await manejador(request)
+            return await perfilador.ejecutar_solicitud(ruta, manejador, request)
+        return manejador_perfilado
@@ -0,0 +1,194 @@
+"""
+replicacion.py
+Replicación primario/réplica de la base de conocimientos.
+El primario anota cada edición de BaseConocimiento en un registro ordenado
+(RegistroEdiciones); las réplicas cargan una instantánea y luego leen el
+registro por HTTP (long-polling) aplicando las operaciones en el mismo orden.
+"""
+
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+
+class HistorialInsuficiente(ValueError):
+    """El registro ya no contiene las operaciones pedidas (o es de otra época)."""
+
+
+class RegistroEdiciones:
+    """
+    Registro en memoria de las operaciones de edición, numeradas desde 1.
+    'epoca' identifica al proceso primario: si se reinicia, las réplicas lo
+    detectan y vuelven a pedir una instantánea.
+    Las ediciones llegan desde hilos del threadpool; las réplicas esperan en el
+    event loop (esperar), así un long-poll no ocupa un hilo mientras tanto.
+    """
+    def __init__(self, capacidad: int = 10000):
+        self.epoca = uuid4().hex
+        self.seq = 0
+        self._entradas: deque = deque(maxlen=capacidad)
+        self._lock = threading.Lock()
+        self._esperas: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def _despertar(self):
+        for loop, evento in self._esperas:
+            loop.call_soon_threadsafe(evento.set)
+
+    def agregar(self, operacion: str, argumentos: Dict[str, Any]) -> dict:
+        with self._lock:
+            self.seq += 1
+            entrada = {"seq": self.seq, "ts": time.time(), "op": operacion, "args": argumentos}
+            self._entradas.append(entrada)
+            self._despertar()
+            return entrada
+
+    def reiniciar(self, seq: int, epoca: str):
+        """Alinea el registro con el de otro nodo (tras cargar su instantánea)."""
+        with self._lock:
+            self.seq = seq
+            self.epoca = epoca
+            self._entradas.clear()
+            self._despertar()
+
+    def desde(self, seq: int, epoca: Optional[str] = None) -> List[dict]:
+        """Devuelve las entradas posteriores a 'seq' (sin esperar)."""
+        with self._lock:
+            if epoca is not None and epoca != self.epoca:
+                raise HistorialInsuficiente("La época del registro cambió; se requiere una instantánea.")
+            if seq > self.seq:
+                raise HistorialInsuficiente(f"La secuencia {seq} es posterior a la última ({self.seq}).")
+            primera = self._entradas[0]["seq"] if self._entradas else self.seq + 1
+            if seq < primera - 1:
+                raise HistorialInsuficiente(f"El registro ya no contiene la secuencia {seq + 1}.")
+            return [e for e in self._entradas if e["seq"] > seq]
+
+    async def esperar(self, seq: int, epoca: Optional[str] = None, espera: float = 0) -> List[dict]:
+        """
+        Como 'desde', pero si no hay entradas nuevas espera hasta 'espera'
+        segundos a que llegue una.
+        """
+        entradas = self.desde(seq, epoca)
+        if entradas or espera <= 0:
+            return entradas
+        evento = asyncio.Event()
+        espera_actual = (asyncio.get_running_loop(), evento)
+        with self._lock:
+            self._esperas.append(espera_actual)
+            hay_nuevas = self.seq != seq or (epoca is not None and epoca != self.epoca)
+        try:
+            if not hay_nuevas:
+                await asyncio.wait_for(evento.wait(), timeout=espera)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._lock:
+                self._esperas.remove(espera_actual)
+        return self.desde(seq, epoca)
+
+
+class Replica:
+    """
+    Hilo que mantiene una BaseConocimiento local al día con el primario.
+    """
+    def __init__(self, primario: str, base, token: Optional[str] = None, espera: float = 25, reintento: float = 2):
+        self.primario = primario.rstrip("/")
+        self.token = token
+        self.base = base
+        self.espera = espera
+        self.reintento = reintento
+        self.seq_primario = 0
+        self.sincronizada = False
+        self.ultimo_contacto: Optional[float] = None
+        self.ultimo_error: Optional[str] = None
+        self._pendiente_desde: Optional[float] = None
+        self._detener = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+
+    def iniciar(self):
+        # Sin token, el primario responde 401 y la réplica serviría su JSON local sin avisar
+        if not self.token:
+            raise RuntimeError(
+                "BIGTOOLS_PRIMARIO está definido pero falta BIGTOOLS_TOKEN_REPLICACION "
+                "(debe ser el mismo valor en el primario y en la réplica)."
+            )
+        self._hilo = threading.Thread(target=self._bucle, name="replica", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def _get(self, path: str, timeout: float) -> dict:
+        solicitud = urllib.request.Request(self.primario + path)
+        if self.token:
+            solicitud.add_header("X-Token-Replicacion", self.token)
+        with urllib.request.urlopen(solicitud, timeout=timeout) as respuesta:
+            return json.loads(respuesta.read().decode("utf8"))
+
+    def _sincronizar(self):
+        instantanea = self._get("/api/replicacion/snapshot", timeout=30)
+        self.base.cargar_instantanea(instantanea)
+        self.seq_primario = instantanea["seq"]
+        self.sincronizada = True
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                if not self.sincronizada:
+                    self._sincronizar()
+                registro = self.base.registro
+                respuesta = self._get(
+                    f"/api/replicacion/log?desde={registro.seq}&epoca={registro.epoca}&espera={self.espera}",
+                    timeout=self.espera + 10,
+                )
+            except urllib.error.HTTPError as e:
+                if e.code == 410:
+                    self.sincronizada = False
+                    continue
+                error = f"HTTP {e.code}: {e.reason}"
+                if e.code in (401, 403) and error != self.ultimo_error:
+                    print(f"Réplica: el primario rechazó el token de replicación ({error}).")
+                self.ultimo_error = error
+                self._detener.wait(self.reintento)
+                continue
+            except (urllib.error.URLError, OSError, ValueError) as e:
+                # Error de red o primario reiniciándose: se reintenta el mismo long-poll.
+                # Si el primario cambió de época, responderá 410 y recién ahí se resincroniza.
+                self.ultimo_error = str(e)
+                self._detener.wait(self.reintento)
+                continue
+            self.ultimo_contacto = time.time()
+            try:
+                self.seq_primario = respuesta["ultima_seq"]
+                entradas = respuesta["entradas"]
+                self._pendiente_desde = entradas[0]["ts"] if entradas else None
+                for entrada in entradas:
+                    self.base.aplicar_operacion(entrada)
+            except (ValueError, KeyError, TypeError) as e:
+                # Un error al aplicar deja la réplica en un estado dudoso: resincronizar
+                self.sincronizada = False
+                self.ultimo_error = f"Error al aplicar el registro: {e}"
+                self._detener.wait(self.reintento)
+                continue
+            self._pendiente_desde = None
+            self.ultimo_error = None
+
+    def estado(self) -> Dict[str, Any]:
+        seq_local = self.base.registro.seq
+        ahora = time.time()
+        return {
+            "rol": "replica",
+            "primario": self.primario,
+            "sincronizada": self.sincronizada,
+            "seq": seq_local,
+            "seq_primario": self.seq_primario,
+            "retraso_operaciones": max(self.seq_primario - seq_local, 0),
+            "retraso_segundos": round(ahora - self._pendiente_desde, 3) if self._pendiente_desde else 0.0,
+            "segundos_desde_contacto": round(ahora - self.ultimo_contacto, 3) if self.ultimo_contacto else None,
+            "ultimo_error": self.ultimo_error,
+        }
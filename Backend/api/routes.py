@@ -4,13 +4,20 @@ Define las rutas de la API del sistema experto.
 Adaptado a la estructura simplificada (sin "categorias").
 """
 
-from fastapi import APIRouter, HTTPException, Body, Depends
-from typing import Dict
+import os
+import threading
 
-from Backend.api.auth import validar_usuario
+from fastapi import APIRouter, HTTPException, Body, Depends, Header, Request, Response
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Optional, Tuple
+
+from Backend.api.auth import validar_usuario, validar_admin, validar_replicacion, TOKEN_REPLICACION
 from Backend.api.base_conocimiento import BaseConocimiento
 from Backend.api.engine import MotorInferencia
 from Backend.api.nodo import Nodo
+from Backend.api.perfilado import RutaPerfilable, perfilador
+from Backend.api.replicacion import HistorialInsuficiente, Replica
+from Backend.api.sitios import RegistroSitios, SitioNoEncontrado, SITIO_PREDETERMINADO
 
 from Backend.api.schemas import (
     RespuestaBody,
@@ -18,13 +25,66 @@ from Backend.api.schemas import (
     SintomaData,
     FallaData,
     SolucionData,
-    RestructuraFallaData
+    SolucionCatalogoData,
+    RestructuraFallaData,
+    PerfiladoData,
+    SitioData
+)
+
+router = APIRouter(prefix="/api", tags=["Sistema Experto"], route_class=RutaPerfilable)
+router_admin = APIRouter(prefix="/api/admin", tags=["Administración"], dependencies=[Depends(validar_admin)])
+
+# Si se define, este nodo es una réplica de solo lectura del primario indicado
+# (ej. BIGTOOLS_PRIMARIO=http://127.0.0.1:8000)
+PRIMARIO = os.environ.get("BIGTOOLS_PRIMARIO")
+
+base = BaseConocimiento(persistir=not PRIMARIO)
+replica = Replica(PRIMARIO, base, token=TOKEN_REPLICACION) if PRIMARIO else None
+# Sesiones por (sitio, id_sesion). Las rutas corren en hilos distintos y el
+# RegistroSitios las limpia al descargar un sitio: todo acceso va con el lock.
+sesiones: Dict[Tuple[str, str], MotorInferencia] = {}
+_sesiones_lock = threading.Lock()
+
+def _obtener_sesion(sitio: str, id_sesion: str) -> Optional[MotorInferencia]:
+    with _sesiones_lock:
+        return sesiones.get((sitio, id_sesion))
+
+def _olvidar_sesiones(sitio: str):
+    """Al descargar un sitio, sus sesiones dejan de ser válidas."""
+    with _sesiones_lock:
+        for clave in [c for c in sesiones if c[0] == sitio]:
+            del sesiones[clave]
+
+# Bases por sitio: se cargan bajo demanda y sólo las más usadas quedan en memoria
+sitios = RegistroSitios(
+    base,
+    capacidad=int(os.environ.get("BIGTOOLS_SITIOS_MAX", "64")),
+    persistir=not PRIMARIO,
+    al_descargar=_olvidar_sesiones
 )
 
-router = APIRouter(prefix="/api", tags=["Sistema Experto"])
+def _redirigir_al_primario(request: Request, detalle: str):
+    """Responde 307 hacia la misma ruta en el primario (conserva método, body y query)."""
+    destino = replica.primario + request.url.path
+    if request.url.query:
+        destino += f"?{request.url.query}"
+    raise HTTPException(status_code=307, detail=detalle, headers={"Location": destino})
 
-base = BaseConocimiento()
-sesiones: Dict[str, MotorInferencia] = {}
+def get_sitio(request: Request, x_sitio: Optional[str] = Header(None), sitio: Optional[str] = None) -> str:
+    """Sitio de la solicitud: cabecera 'X-Sitio' o parámetro '?sitio='; si no, el predeterminado."""
+    sitio = x_sitio or sitio or SITIO_PREDETERMINADO
+    # Sólo la base predeterminada se replica: los sitios se atienden en el primario
+    if replica is not None and sitio != SITIO_PREDETERMINADO:
+        _redirigir_al_primario(request, "Las bases por sitio no se replican. Use el primario.")
+    return sitio
+
+def get_base(sitio: str = Depends(get_sitio)) -> BaseConocimiento:
+    try:
+        return sitios.obtener(sitio)
+    except SitioNoEncontrado as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # ---------------- Rutas de diagnóstico ----------------
 
@@ -33,16 +93,35 @@ def home():
     return {"mensaje": "API del Sistema Experto activa"}
 
 @router.get("/maquinas")
-def listar_maquinas():
+def listar_maquinas(base: BaseConocimiento = Depends(get_base)):
     return {"maquinas": base.listar_maquinas()}
 
+@router.get("/catalogo", summary="Catálogo compartido de soluciones y referencias")
+def obtener_catalogo(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    base: BaseConocimiento = Depends(get_base)
+):
+    etag = f'"{base.version_catalogo()}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return base.catalogo_combinado()
+
 @router.post("/diagnosticar/iniciar/{nombre_maquina}")
-def iniciar_diagnostico(nombre_maquina: str):
+def iniciar_diagnostico(
+    nombre_maquina: str,
+    ids: bool = False,
+    sitio: str = Depends(get_sitio),
+    base: BaseConocimiento = Depends(get_base)
+):
     try:
-        motor = MotorInferencia(base)
+        motor = MotorInferencia(base, incluir_ids=ids)
         resultado = motor.iniciar_diagnostico(nombre_maquina)
-        key = "default_user"
-        sesiones[key] = motor
+        key = (sitio, "default_user")
+        with _sesiones_lock:
+            sesiones[key] = motor
         return resultado
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -50,8 +129,8 @@ def iniciar_diagnostico(nombre_maquina: str):
         raise HTTPException(status_code=500, detail=f"Error interno: {e}")
 
 @router.post("/diagnosticar/avanzar/{id_sesion}")
-def avanzar_diagnostico(id_sesion: str, body: RespuestaBody):
-    motor = sesiones.get(id_sesion)
+def avanzar_diagnostico(id_sesion: str, body: RespuestaBody, sitio: str = Depends(get_sitio)):
+    motor = _obtener_sesion(sitio, id_sesion)
     if motor is None:
         raise HTTPException(status_code=404, detail="No se encontró una sesión activa. Por favor, reinicie el chat.")
     try:
@@ -60,10 +139,60 @@ def avanzar_diagnostico(id_sesion: str, body: RespuestaBody):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# ---------------- Rutas de replicación ----------------
+
+@router.get("/replicacion/estado", summary="Rol del nodo y retraso de la réplica")
+def estado_replicacion():
+    if replica is not None:
+        return replica.estado()
+    return {"rol": "primario", "seq": base.registro.seq, "epoca": base.registro.epoca}
+
+@router.get(
+    "/replicacion/snapshot",
+    summary="Instantánea completa de la base y su posición en el registro",
+    dependencies=[Depends(validar_replicacion)]
+)
+def snapshot_replicacion():
+    return base.instantanea()
+
+@router.get(
+    "/replicacion/log",
+    summary="Operaciones de edición posteriores a 'desde'",
+    dependencies=[Depends(validar_replicacion)]
+)
+async def log_replicacion(desde: int = 0, epoca: Optional[str] = None, espera: float = 0):
+    # Asíncrona: cada réplica espera en el event loop, no en un hilo del threadpool
+    try:
+        entradas = await base.registro.esperar(desde, epoca, min(max(espera, 0), 30))
+    except HistorialInsuficiente as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    return {"epoca": base.registro.epoca, "ultima_seq": base.registro.seq, "entradas": entradas}
+
 # ---------------- Rutas de edición ----------------
 
-@router.post("/agregar/maquina", summary="Agrega una nueva máquina")
-def agregar_maquina(data: MaquinaData):
+def solo_primario(request: Request):
+    """En una réplica, redirige las ediciones al primario (307 conserva método y body)."""
+    if replica is None:
+        return
+    _redirigir_al_primario(request, "Este nodo es una réplica de solo lectura. Las ediciones se hacen en el primario.")
+
+def solo_primario_con_sesion():
+    """
+    Las ediciones que dependen de una sesión de diagnóstico no pueden
+    redirigirse: la sesión sólo existe en el nodo que la creó.
+    """
+    if replica is None:
+        return
+    raise HTTPException(
+        status_code=409,
+        detail=(
+            "Este nodo es una réplica de solo lectura y la sesión de diagnóstico es local. "
+            f"Para editar, inicie el diagnóstico en el primario ({replica.primario})."
+        ),
+    )
+
+@router.post("/agregar/maquina", summary="Agrega una nueva máquina", dependencies=[Depends(solo_primario)])
+def agregar_maquina(data: MaquinaData, base: BaseConocimiento = Depends(get_base)):
     try:
         base.agregar_maquina(data.nombre)
         # Agrega rama terminal inicial bajo la pregunta principal
@@ -79,18 +208,18 @@ def agregar_maquina(data: MaquinaData):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def get_motor_de_sesion(id_sesion: str) -> MotorInferencia:
-    motor = sesiones.get(id_sesion)
+def get_motor_de_sesion(id_sesion: str, sitio: str = Depends(get_sitio)) -> MotorInferencia:
+    motor = _obtener_sesion(sitio, id_sesion)
     if motor is None:
         raise HTTPException(status_code=404, detail="Sesión de diagnóstico no encontrada. No se puede agregar el nodo.")
     return motor
 
-@router.post("/agregar/sintoma/{id_sesion}", summary="Agrega un nuevo síntoma HOJA")
+@router.post("/agregar/sintoma/{id_sesion}", summary="Agrega un nuevo síntoma HOJA", dependencies=[Depends(solo_primario_con_sesion)])
 def agregar_sintoma(data: FallaData, motor: MotorInferencia = Depends(get_motor_de_sesion)):
     try:
         path_padre = motor.get_path_a_pregunta()
         nueva_rama_dict = data.model_dump()
-        base.agregar_rama(motor.maquina_actual, path_padre, nueva_rama_dict)
+        motor.base.agregar_rama(motor.maquina_actual, path_padre, nueva_rama_dict)
         return {"success": True, "message": f"Síntoma terminal '{data.atributo}' agregado con falla '{data.falla}'."}
     except ValueError as e:
         if "falla" in str(e):
@@ -102,12 +231,12 @@ def agregar_sintoma(data: FallaData, motor: MotorInferencia = Depends(get_motor_
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/agregar/falla/{id_sesion}", summary="Agrega una nueva falla (hoja)")
+@router.post("/agregar/falla/{id_sesion}", summary="Agrega una nueva falla (hoja)", dependencies=[Depends(solo_primario_con_sesion)])
 def agregar_falla(data: FallaData, motor: MotorInferencia = Depends(get_motor_de_sesion)):
     try:
         path_padre = motor.get_path_a_pregunta()
         nueva_rama_dict = data.model_dump()
-        nodo_padre = base.find_nodo_by_path(motor.maquina_actual, path_padre)
+        nodo_padre = motor.base.find_nodo_by_path(motor.maquina_actual, path_padre)
         if nodo_padre.es_hoja():
             raise HTTPException(
                 status_code=409,
@@ -119,14 +248,14 @@ def agregar_falla(data: FallaData, motor: MotorInferencia = Depends(get_motor_de
                 status_code=409,
                 detail=f"CONFLICT: El síntoma al que intenta agregar una falla ya conduce a la falla: '{falla_existente.falla}'. Use el formulario de reestructuración.",
             )
-        base.agregar_rama(motor.maquina_actual, path_padre, nueva_rama_dict)
+        motor.base.agregar_rama(motor.maquina_actual, path_padre, nueva_rama_dict)
         return {"success": True, "message": f"Falla '{data.falla}' agregada."}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/restructurar/falla/{id_sesion}", summary="Restructura una falla en una pregunta")
+@router.post("/restructurar/falla/{id_sesion}", summary="Restructura una falla en una pregunta", dependencies=[Depends(solo_primario_con_sesion)])
 def restructurar_falla(data: RestructuraFallaData, motor: MotorInferencia = Depends(get_motor_de_sesion)):
     try:
         path_a_restructurar = motor.get_historial_path_completo()
@@ -141,7 +270,7 @@ def restructurar_falla(data: RestructuraFallaData, motor: MotorInferencia = Depe
             "soluciones": data.soluciones_nuevas,
             "referencia": data.referencia_nueva
         }
-        base.restructurar_falla_a_pregunta(
+        motor.base.restructurar_falla_a_pregunta(
             nombre_maquina=motor.maquina_actual,
             path_a_hoja=path_a_restructurar,
             pregunta_nueva=data.pregunta_nueva,
@@ -156,22 +285,86 @@ def restructurar_falla(data: RestructuraFallaData, motor: MotorInferencia = Depe
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/agregar/solucion/{id_sesion}", summary="Agrega una solución a una falla existente")
+@router.post("/agregar/solucion/{id_sesion}", summary="Agrega una solución a una falla existente", dependencies=[Depends(solo_primario_con_sesion)])
 def agregar_solucion(data: SolucionData, motor: MotorInferencia = Depends(get_motor_de_sesion)):
     try:
         path_a_falla = motor.get_historial_path_completo()
         if not motor.nodo_actual or not motor.nodo_actual.es_hoja():
             raise ValueError("No se puede agregar una solución a un nodo que no es una falla (el nodo actual es una pregunta).")
-        base.agregar_solucion(motor.maquina_actual, path_a_falla, data.solucion_nueva)
+        motor.base.agregar_solucion(motor.maquina_actual, path_a_falla, data.solucion_nueva)
         return {"success": True, "message": f"Solución agregada a la falla '{motor.nodo_actual.falla}'."}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/editar/solucion/{id_solucion}", summary="Edita una solución del catálogo compartido", dependencies=[Depends(solo_primario)])
+def editar_solucion_catalogo(
+    id_solucion: str,
+    data: SolucionCatalogoData,
+    base: BaseConocimiento = Depends(get_base)
+):
+    try:
+        actualizadas = base.editar_solucion_catalogo(id_solucion, data.texto)
+        return {"success": True, "message": f"Solución '{id_solucion}' actualizada en {actualizadas} falla(s)."}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ---------------- Rutas de login ----------------
 @router.post("/login_admin")
 def login_admin(username: str = Body(...), password: str = Body(...)):
     if validar_usuario(username, password):
         return {"success": True, "message": "Login correcto"}
     raise HTTPException(status_code=401, detail="Usuario o contraseña incorrectos")
+
+# ---------------- Rutas de administración (sitios) ----------------
+@router_admin.get("/sitios", summary="Sitios disponibles y cargados en memoria")
+def listar_sitios():
+    return {"sitios": sitios.listar(), "cargados": sitios.cargadas(), "capacidad": sitios.capacidad}
+
+@router_admin.post("/sitios", summary="Crea la base de un sitio", dependencies=[Depends(solo_primario)])
+def crear_sitio(data: SitioData):
+    try:
+        sitios.crear(data.nombre, data.hereda, data.description)
+        return {"success": True, "message": f"Sitio '{data.nombre}' creado."}
+    except SitioNoEncontrado as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router_admin.post("/sitios/{sitio}/descargar", summary="Libera de memoria la base de un sitio")
+def descargar_sitio(sitio: str):
+    return {"success": sitios.descargar(sitio), "cargados": sitios.cargadas()}
+
+# ---------------- Rutas de administración (perfilado) ----------------
+@router_admin.get("/perfilado", summary="Estado del perfilador")
+def estado_perfilado():
+    return perfilador.estado()
+
+@router_admin.post("/perfilado/activar", summary="Perfila las próximas N solicitudes")
+def activar_perfilado(data: PerfiladoData):
+    try:
+        perfilador.activar(data.modo, data.solicitudes, data.patron, data.intervalo_ms)
+        return {"success": True, **perfilador.estado()}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router_admin.post("/perfilado/desactivar", summary="Detiene el perfilado")
+def desactivar_perfilado():
+    perfilador.desactivar()
+    return {"success": True, **perfilador.estado()}
+
+@router_admin.post("/perfilado/limpiar", summary="Descarta las pilas acumuladas")
+def limpiar_perfilado():
+    perfilador.limpiar()
+    return {"success": True}
+
+@router_admin.get("/perfilado/collapsed", summary="Pilas agregadas en formato collapsed", response_class=PlainTextResponse)
+def perfilado_collapsed():
+    return perfilador.collapsed()
+
+@router_admin.get("/perfilado/flamegraph", summary="Flame graph SVG de las pilas agregadas")
+def perfilado_flamegraph():
+    return Response(content=perfilador.flamegraph_svg(), media_type="image/svg+xml")
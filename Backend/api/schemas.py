@@ -5,7 +5,7 @@ usados para la validación de datos de entrada en la API.
 """
 
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 # --- MODELOS DE ENTRADA Y VALIDACIÓN ---
 
@@ -42,6 +42,10 @@ class SolucionData(BaseModel):
     """Esquema para agregar una nueva solución a una falla existente."""
     solucion_nueva: str = Field(..., min_length=5)
 
+class SolucionCatalogoData(BaseModel):
+    """Esquema para editar el texto de una solución del catálogo compartido."""
+    texto: str = Field(..., min_length=5)
+
 class RestructuraFallaData(BaseModel):
     """
     Esquema para restructurar un nodo de falla única en un nodo de pregunta con dos fallas.
@@ -59,3 +63,23 @@ class RestructuraFallaData(BaseModel):
     falla_nueva: str = Field(..., min_length=5)
     soluciones_nuevas: List[str] = []
     referencia_nueva: Optional[str] = None
+
+class SitioData(BaseModel):
+    """
+    Esquema para crear la base de un sitio.
+    'hereda' es el sitio cuya base se usa debajo (ej. "default"); si se omite,
+    el sitio empieza vacío.
+    """
+    nombre: str = Field(..., min_length=1, max_length=64)
+    hereda: Optional[str] = None
+    description: Optional[str] = None
+
+class PerfiladoData(BaseModel):
+    """
+    Esquema para activar el perfilado bajo demanda.
+    'patron' es una expresión regular sobre la ruta (ej. "diagnosticar|agregar").
+    """
+    modo: Literal["muestreo", "determinista"] = "muestreo"
+    solicitudes: int = Field(10, ge=1, le=10000)
+    patron: Optional[str] = None
+    intervalo_ms: float = Field(5.0, ge=0.5, le=1000)
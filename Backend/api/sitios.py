@@ -0,0 +1,156 @@
+"""
+sitios.py
+Bases de conocimientos por sitio (cliente o planta).
+Cada sitio tiene su propio JSON en DIRECTORIO_SITIOS y se carga bajo demanda;
+sólo se mantienen en memoria los 'capacidad' sitios usados más recientemente.
+Un sitio puede heredar de otro ("__hereda" en su JSON, por ejemplo "default"):
+ve las máquinas de la base heredada sin copiarlas y sólo copia una máquina
+cuando la edita.
+"""
+
+import json
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Optional, Set
+
+from Backend.api.base_conocimiento import BaseConocimiento, JSON_LATEST
+
+SITIO_PREDETERMINADO = "default"
+DIRECTORIO_SITIOS = "Backend/data/sitios"
+_NOMBRE_VALIDO = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+
+
+class SitioNoEncontrado(ValueError):
+    """El sitio pedido no tiene una base de conocimientos."""
+
+
+class RegistroSitios:
+    """
+    Caché LRU de bases por sitio. La base predeterminada (la de DEFAULT_JSON)
+    nunca se descarga.
+    """
+    def __init__(
+        self,
+        predeterminada: BaseConocimiento,
+        directorio: str = DIRECTORIO_SITIOS,
+        capacidad: int = 64,
+        persistir: bool = True,
+        al_descargar: Optional[Callable[[str], None]] = None
+    ):
+        self.predeterminada = predeterminada
+        self.directorio = Path(directorio)
+        self.capacidad = max(capacidad, 1)
+        self.persistir = persistir
+        self.al_descargar = al_descargar
+        self._cargadas: "OrderedDict[str, BaseConocimiento]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    # ------------ CONSULTA ----------------
+    def validar_nombre(self, sitio: str) -> str:
+        if not _NOMBRE_VALIDO.match(sitio):
+            raise ValueError(f"Nombre de sitio inválido: '{sitio}'. Use minúsculas, números, '-' o '_'.")
+        return sitio
+
+    def ruta(self, sitio: str) -> Path:
+        return self.directorio / f"{self.validar_nombre(sitio)}.json"
+
+    def existe(self, sitio: str) -> bool:
+        return sitio == SITIO_PREDETERMINADO or self.ruta(sitio).exists()
+
+    def listar(self) -> List[str]:
+        disponibles = sorted(p.stem for p in self.directorio.glob("*.json")) if self.directorio.exists() else []
+        return [SITIO_PREDETERMINADO] + disponibles
+
+    def cargadas(self) -> List[str]:
+        with self._lock:
+            return list(self._cargadas)
+
+    def obtener(self, sitio: Optional[str] = None) -> BaseConocimiento:
+        if not sitio or sitio == SITIO_PREDETERMINADO:
+            return self.predeterminada
+        with self._lock:
+            return self._obtener(sitio, set())
+
+    def _obtener(self, sitio: str, cadena: Set[str]) -> BaseConocimiento:
+        if not sitio or sitio == SITIO_PREDETERMINADO:
+            return self.predeterminada
+        base = self._cargadas.get(sitio)
+        if base is not None:
+            self._cargadas.move_to_end(sitio)
+            return base
+        if sitio in cadena:
+            raise ValueError(f"Herencia circular entre sitios: {' -> '.join(cadena)} -> {sitio}.")
+        ruta = self.ruta(sitio)
+        if not ruta.exists():
+            raise SitioNoEncontrado(f"No se encontró el sitio: {sitio}")
+        # La base heredada se carga primero: las hojas del sitio apuntan a sus IDs
+        base = BaseConocimiento(
+            str(ruta),
+            persistir=self.persistir,
+            espacio=f"{sitio}.",
+            con_registro=False,
+            resolver_padre=lambda hereda: self._obtener(hereda, cadena | {sitio})
+        )
+        self._cargadas[sitio] = base
+        self._liberar(protegidas=self._ancestros(sitio))
+        return base
+
+    def _ancestros(self, sitio: str) -> Set[str]:
+        nombres = set()
+        while sitio and sitio != SITIO_PREDETERMINADO and sitio not in nombres:
+            nombres.add(sitio)
+            base = self._cargadas.get(sitio)
+            sitio = base.hereda if base else None
+        return nombres
+
+    def _liberar(self, protegidas: Set[str]):
+        for sitio in list(self._cargadas):
+            if len(self._cargadas) <= self.capacidad:
+                return
+            if sitio not in protegidas:
+                self._descargar(sitio)
+
+    # ------------ ADMINISTRACIÓN ----------------
+    def crear(self, sitio: str, hereda: Optional[str] = None, description: Optional[str] = None) -> BaseConocimiento:
+        with self._lock:
+            if self.existe(sitio):
+                raise ValueError(f"El sitio '{sitio}' ya existe.")
+            if hereda and not self.existe(hereda):
+                raise SitioNoEncontrado(f"No se encontró el sitio a heredar: {hereda}")
+            self.directorio.mkdir(parents=True, exist_ok=True)
+            obj = {
+                "__v": JSON_LATEST,
+                "description": description or f"Base de conocimientos del sitio {sitio}"
+            }
+            if hereda:
+                obj["__hereda"] = hereda
+            with open(self.ruta(sitio), 'w', encoding='utf8') as f:
+                f.write(json.dumps(obj, indent=2, ensure_ascii=False))
+            return self._obtener(sitio, set())
+
+    def descargar(self, sitio: str) -> bool:
+        with self._lock:
+            if sitio not in self._cargadas:
+                return False
+            self._descargar(sitio)
+            return True
+
+    def _descargar(self, sitio: str):
+        base = self._cargadas.get(sitio)
+        if base is None:
+            return
+        # Las superposiciones cargadas apuntan a esta base: se descargan también
+        for hijo in [s for s, b in self._cargadas.items() if b.padre is base]:
+            self._descargar(hijo)
+        # Con el lock de la base, una edición en curso termina (y guarda el JSON)
+        # antes de descargarla; las posteriores sobre esta copia se rechazan, así
+        # no compiten con la copia que se cargue de nuevo desde el archivo.
+        with base._lock:
+            base.descargada = True
+            del self._cargadas[sitio]
+            if base.padre is not None:
+                base.padre.hijas.discard(base)
+        if self.al_descargar:
+            self.al_descargar(sitio)
@@ -3,9 +3,23 @@ app.py
 Entrada principal de la API del sistema experto.
 """
 
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from Backend.api.routes import router
+from Backend.api.routes import router, router_admin, replica
+
+# ---------------------------------------------------------------------
+# Ciclo de vida: en modo réplica, seguir el registro del primario
+# ---------------------------------------------------------------------
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if replica is not None:
+        replica.iniciar()
+    yield
+    if replica is not None:
+        replica.detener()
 
 # ---------------------------------------------------------------------
 # Instancia de FastAPI
@@ -15,6 +29,7 @@ app = FastAPI(
     title="Sistema Experto de Diagnóstico de Máquinas Big Tools",
     description="API para diagnosticar fallas en máquinas y ofrecer posibles soluciones",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # ---------------------------------------------------------------------
@@ -38,6 +53,7 @@ app.add_middleware(
 # ---------------------------------------------------------------------
 
 app.include_router(router)
+app.include_router(router_admin)
 
 # ---------------------------------------------------------------------
 # Ruta raíz opcional